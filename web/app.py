@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
 
+from datos import huella_archivo
+
 # -----------------------------------
 # Configuración de página
 # -----------------------------------
@@ -12,10 +14,18 @@ st.set_page_config(
 # -----------------------------------
 # Cargar datos desde Excel
 # -----------------------------------
-@st.cache_data
-def load_data():
-    # Lee el archivo Excel (ruta relativa desde donde ejecutas Streamlit)
-    df = pd.read_excel("web/totales.xlsx")
+DATA_PATH = "web/totales.xlsx"
+
+
+@st.cache_resource(max_entries=2)
+def load_data(excel_file, huella):
+    # Lee el archivo Excel (ruta relativa desde donde ejecutas Streamlit).
+    # `huella` solo forma parte de la clave de caché: si el archivo cambia,
+    # se recarga sin tocar el resto de entradas. Como recurso, las sesiones
+    # comparten el DataFrame sin copiarlo: NO debe modificarse. Se guardan
+    # a lo más 2 versiones (la vigente y la anterior) para no acumular una
+    # copia por cada cambio del archivo.
+    df = pd.read_excel(excel_file)
 
     # Ajusta los nombres de columnas según tu archivo
     df = df.rename(columns={
@@ -25,7 +35,22 @@ def load_data():
 
     return df
 
-df = load_data()
+
+@st.cache_data
+def totales_globales(excel_file, huella):
+    # Totales de todas las empresas; dependen solo de la versión del archivo
+    df = load_data(excel_file, huella)
+    return (
+        df["TOTAL KM"].sum(),
+        df["CO2 EVITADO"].sum(),
+        df["KG"].sum(),
+        df["HORAS DE RUTA"].sum(),
+        df["KWH/KM"].sum(),
+    )
+
+
+huella_datos = huella_archivo(DATA_PATH)
+df = load_data(DATA_PATH, huella_datos)
 
 st.title("Piloto E-Moviliza")
 st.caption("Periodo del 18 de agosto de 2025 al 19 de septiembre de 2025")
@@ -43,20 +68,23 @@ clientes_seleccionados = st.sidebar.multiselect(
     default=clientes_disponibles  # por defecto todas
 )
 
-# Aplicar filtro SOLO para indicadores y detalle
-if clientes_seleccionados:
-    df_filtrado = df[df["CLIENTE"].isin(clientes_seleccionados)].copy()
+# Aplicar filtro SOLO para indicadores y detalle (sin copias: df_filtrado
+# no se modifica)
+if clientes_seleccionados and len(clientes_seleccionados) < len(clientes_disponibles):
+    df_filtrado = df[df["CLIENTE"].isin(clientes_seleccionados)]
 else:
-    df_filtrado = df.copy()
+    df_filtrado = df
 
 # -----------------------------------
 # TOTALES GLOBALES (todas las empresas)
 # -----------------------------------
-total_km_global = df["TOTAL KM"].sum()
-total_co2_global = df["CO2 EVITADO"].sum()
-total_kg_global = df["KG"].sum()
-total_horas_global = df["HORAS DE RUTA"].sum()
-total_consumo_energ = df["KWH/KM"].sum()
+(
+    total_km_global,
+    total_co2_global,
+    total_kg_global,
+    total_horas_global,
+    total_consumo_energ,
+) = totales_globales(DATA_PATH, huella_datos)
 
 # ==== ESTILO DE TARJETAS (CSS) ====
 st.markdown("""
@@ -1,8 +1,21 @@
+import os
+
 import streamlit as st
 import pandas as pd
 from datetime import date
 import altair as alt
 
+from datos import (
+    Fuente,
+    abrir_malla,
+    cargar_fuentes,
+    filtrar_malla,
+    filtrar_registro,
+    huella_archivo,
+    leer_excel,
+    leer_meta_malla,
+)
+
 
 # -------------------------------
 # Config página + estilo (fondo azul marino)
@@ -106,29 +119,47 @@ def _read_excel_any_sheet(excel_file, sheet_try):
     raise last_err
 
 
-@st.cache_data
-def load_daily_data(excel_file) -> pd.DataFrame:
+@st.cache_resource(max_entries=2)
+def load_daily_data(excel_file, huella) -> pd.DataFrame:
     """
     Carga la hoja principal (primera hoja) con columnas diarias:
     fecha, km, Kg, tiempo, empresa
+
+    `huella` (ver datos.huella_archivo) solo entra en la clave de caché.
+    Se cachea como recurso: todas las sesiones comparten el mismo DataFrame
+    sin copiarlo en cada rerun, así que NO debe modificarse. Guarda a lo
+    más 2 versiones del archivo para no acumular una por cada cambio.
     """
-    df = pd.read_excel(excel_file, sheet_name=0)
+    df = leer_excel(excel_file, sheet_name=0)
     df.columns = [c.strip() for c in df.columns]
 
-    # Asegura fecha como datetime
-    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    # Asegura fecha como datetime, sin hora (00:00:00 siempre)
+    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce").dt.normalize()
 
     # Asegura numéricos
     for col in ["km", "Kg", "tiempo"]:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
+    # Ordenada por fecha para que filtrar_registro corte por posición
     df = df.dropna(subset=["fecha"])
+    df = df.sort_values("fecha", kind="stable", ignore_index=True)
     return df
 
 
+@st.cache_resource(max_entries=2)
+def load_daily_grid(grid_file, huella):
+    """
+    Abre la malla diaria binaria (fechas × empresas × métricas) que genera
+    relleno_registro.py, mapeada en memoria y de solo lectura. Devuelve
+    (malla, meta); ver datos.abrir_malla. Con max_entries, el mapeo de una
+    versión reemplazada se libera en vez de quedar abierto para siempre.
+    """
+    return abrir_malla(grid_file)
+
+
 @st.cache_data
-def load_kpis_hoja2_totales(excel_file):
+def load_kpis_hoja2_totales(excel_file, huella):
     """
     Hoja2:
     header: periodo | consumo | km | CO2 URBANO | <empresa> | <marca>
@@ -139,7 +170,7 @@ def load_kpis_hoja2_totales(excel_file):
       km_total (km)
       co2_total (kg)
     """
-    df2 = pd.read_excel(excel_file, sheet_name="Hoja2", header=None)
+    df2 = leer_excel(excel_file, sheet_name="Hoja2", header=None)
 
     def to_float(x):
         if pd.isna(x):
@@ -175,6 +206,31 @@ def load_kpis_hoja2_totales(excel_file):
     return consumo_total, km_total, co2_total
 
 
+@st.cache_resource(max_entries=2)
+def load_sources(excel_file, huella, grid_file=None, huella_grid=None):
+    """
+    Carga en frío de todas las fuentes con datos.cargar_fuentes (hilos,
+    timeout por fuente) y devuelve (datos, errores). Los datos diarios
+    salen de la malla si se pasa `grid_file`, si no de la hoja principal.
+
+    Cacheada por las huellas: un rerun con las mismas versiones no arranca
+    hilos. Si hubo errores, quien llama debe borrar la entrada (.clear con
+    los mismos argumentos) para reintentar en el siguiente rerun. NO debe
+    modificarse lo devuelto.
+    """
+    if grid_file is not None:
+        fuente_diaria = Fuente("diario", lambda: load_daily_grid(grid_file, huella_grid))
+    else:
+        fuente_diaria = Fuente("diario", lambda: load_daily_data(excel_file, huella))
+
+    return cargar_fuentes(
+        [
+            fuente_diaria,
+            Fuente("hoja2", lambda: load_kpis_hoja2_totales(excel_file, huella)),
+        ]
+    )
+
+
 # -------------------------------
 # Utilidades
 # -------------------------------
@@ -194,14 +250,83 @@ def totals_block(df_in: pd.DataFrame):
     return total_km, total_kg, total_tiempo_h
 
 
+@st.cache_data
+def totals_fixed_period(excel_file, huella, start, end):
+    """
+    Totales (km, Kg, tiempo) del periodo fijo; solo se recalculan cuando
+    cambia la versión del archivo.
+    """
+    df_in = filtrar_registro(load_daily_data(excel_file, huella), start, end)
+    return totals_block(df_in)
+
+
+@st.cache_data
+def totals_fixed_period_grid(grid_file, huella, start, end):
+    """Igual que totals_fixed_period, pero sobre la malla diaria."""
+    malla, meta = load_daily_grid(grid_file, huella)
+    return totals_block(filtrar_malla(malla, meta, start, end))
+
+
 # -------------------------------
 # Carga de datos
 # -------------------------------
 DEFAULT_PATH = "web/registro_semanal_completo.xlsx"
+# Si existe y se generó a partir de este mismo Excel (ver relleno_registro.py),
+# los datos diarios salen de la malla binaria en vez de la hoja principal
+GRID_PATH = "web/registro_diario.npy"
 
+# Las fuentes se cargan con load_sources; para sumar una fuente nueva,
+# agrega otra Fuente a su lista.
 try:
     excel_source = DEFAULT_PATH
-    df = load_daily_data(excel_source)
+    huella_datos = huella_archivo(excel_source)
+
+    # Una malla vieja (el Excel cambió después) o a medio escribir se ignora
+    meta_disco = leer_meta_malla(GRID_PATH)
+    usa_malla = (
+        os.path.exists(GRID_PATH)
+        and meta_disco is not None
+        and meta_disco.get("huella_excel") == huella_datos
+    )
+    if usa_malla:
+        huella_malla = huella_archivo(GRID_PATH)
+        args_carga = (excel_source, huella_datos, GRID_PATH, huella_malla)
+    else:
+        args_carga = (excel_source, huella_datos)
+
+    datos_cargados, errores_carga = load_sources(*args_carga)
+    datos_cargados = dict(datos_cargados)  # el de la caché no se toca
+    if errores_carga:
+        # Una carga incompleta no se queda en caché: el siguiente rerun reintenta
+        load_sources.clear(*args_carga)
+    if usa_malla and "diario" in errores_carga:
+        # La malla no abrió (p. ej. no coincide con su .json): se usa el Excel
+        usa_malla = False
+        datos_cargados["diario"] = load_daily_data(excel_source, huella_datos)
+
+    # Desde aquí el tablero solo usa filtrar_diario, columnas_diario,
+    # rango_fechas y empresas, sin importar de dónde vengan los datos
+    if usa_malla:
+        malla, meta_malla = datos_cargados["diario"]
+        columnas_diario = {"fecha", "empresa", *meta_malla["metricas"]}
+        fechas_malla = pd.date_range(meta_malla["origen"], periods=malla.shape[0], freq="D")
+        rango_fechas = (fechas_malla[0], fechas_malla[-1])
+        empresas = list(meta_malla["empresas"])
+
+        def filtrar_diario(desde, hasta, empresas_sel=None):
+            # Índices por aritmética de fechas/empresas: solo se lee la salida
+            return filtrar_malla(malla, meta_malla, desde, hasta, empresas_sel)
+
+    else:
+        df = datos_cargados["diario"]
+        columnas_diario = set(df.columns)
+        rango_fechas = (df["fecha"].min(), df["fecha"].max())
+        empresas = sorted(df["empresa"].dropna().unique().tolist())
+
+        def filtrar_diario(desde, hasta, empresas_sel=None):
+            # Comparte memoria con df, no modificar
+            return filtrar_registro(df, desde, hasta, empresas_sel)
+
 except Exception:
     st.error(
         "No pude abrir 'registro_semanal.xlsx'. "
@@ -211,7 +336,7 @@ except Exception:
 
 # Validación de columnas necesarias
 required = {"fecha", "km", "Kg", "tiempo", "empresa"}
-missing = required - set(df.columns)
+missing = required - columnas_diario
 if missing:
     st.error(f"Faltan columnas en la hoja principal del Excel: {missing}")
     st.stop()
@@ -246,18 +371,22 @@ TOTAL_CONDUCTORES = N_HOMBRES + N_MUJERES
 start_fixed = pd.Timestamp(date(2025, 8, 18))
 end_fixed = pd.Timestamp(date(2025, 11, 12))
 
-df_fixed = df[(df["fecha"] >= start_fixed) & (df["fecha"] <= end_fixed)].copy()
-km_fixed, kg_fixed, t_fixed = totals_block(df_fixed)
+if usa_malla:
+    km_fixed, kg_fixed, t_fixed = totals_fixed_period_grid(
+        GRID_PATH, huella_malla, start_fixed, end_fixed
+    )
+else:
+    km_fixed, kg_fixed, t_fixed = totals_fixed_period(
+        excel_source, huella_datos, start_fixed, end_fixed
+    )
 
 # KPIs extra desde Hoja2
 consumo_total = float("nan")
 km_total_hoja2 = float("nan")
 co2_total = float("nan")
 
-try:
-    consumo_total, km_total_hoja2, co2_total = load_kpis_hoja2_totales(excel_source)
-except Exception:
-    pass
+if "hoja2" in datos_cargados:
+    consumo_total, km_total_hoja2, co2_total = datos_cargados["hoja2"]
 
 consumo_kwh_km = (
     consumo_total / km_total_hoja2
@@ -367,10 +496,11 @@ st.markdown("---")
 # -------------------------------
 st.subheader("🎛️ Filtros para tablas y gráficas")
 
-min_date = df["fecha"].min().date()
-max_date = df["fecha"].max().date()
+min_date = rango_fechas[0].date()
+max_date = rango_fechas[1].date()
 
-empresas = sorted(df["empresa"].dropna().unique().tolist())
+# Banderas de anomalías calculadas al ingerir (relleno_registro.py)
+hay_anomalias = "anomalia" in columnas_diario
 
 colf1, colf2 = st.columns([2, 1])
 
@@ -389,6 +519,13 @@ with colf2:
         default=empresas,  # por defecto: todas seleccionadas
     )
 
+excluir_sospechosos = hay_anomalias and st.checkbox(
+    "Excluir días sospechosos",
+    value=False,
+    help="Días marcados al cargar los datos: razones imposibles "
+    "(p. ej. km sin tiempo) o valores atípicos para la empresa.",
+)
+
 # Garantiza al menos una empresa seleccionada
 if not emp_sel_list:
     emp_sel_list = empresas[:]  # vuelve a seleccionar todas
@@ -402,8 +539,18 @@ else:
 d1_ts = pd.Timestamp(d1)
 d2_ts = pd.Timestamp(d2)
 
-df_f = df[(df["fecha"] >= d1_ts) & (df["fecha"] <= d2_ts)].copy()
-df_f = df_f[df_f["empresa"].isin(emp_sel_list)].copy()
+# Un solo paso (fechas + empresas); no modificar df_f
+df_f = filtrar_diario(d1_ts, d2_ts, emp_sel_list)
+
+if hay_anomalias:
+    n_sospechosos = int(df_f["anomalia"].sum())
+    if excluir_sospechosos:
+        df_f = df_f[~df_f["anomalia"]]
+    if n_sospechosos:
+        st.caption(
+            f"⚠️ {n_sospechosos} día(s) sospechoso(s) en el filtro: "
+            + ("excluidos de tablas y gráficas." if excluir_sospechosos else "resaltados en las gráficas.")
+        )
 
 
 # -------------------------------
@@ -458,41 +605,56 @@ st.markdown("---")
 # -------------------------------
 st.subheader("📈 Gráficas")
 
-# Asegura fecha sin hora (solo día)
-df_f = df_f.copy()
-df_f["fecha"] = pd.to_datetime(df_f["fecha"]).dt.normalize()  # 00:00:00 siempre
+# "fecha" ya viene sin hora desde load_daily_data
 
 tab_km, tab_kg, tab_t = st.tabs(["🛣️ Km", "📦 Kg", "⏱️ Tiempo"])
 
 
 def make_line_chart(df_plot: pd.DataFrame, y_col: str, y_title: str):
-    return (
+    x = alt.X(
+        "fecha:T",
+        title="Fecha",
+        axis=alt.Axis(
+            format="%a %d",  # lun 18 (depende de locale del sistema)
+            labelAngle=0,
+            tickCount="day",
+        ),
+    )
+    y = alt.Y(f"{y_col}:Q", title=y_title)
+    tooltip = [
+        alt.Tooltip("fecha:T", title="Fecha", format="%A %d"),
+        alt.Tooltip("empresa:N", title="Empresa"),
+        alt.Tooltip(f"{y_col}:Q", title=y_title, format=",.2f"),
+    ]
+
+    chart = (
         alt.Chart(df_plot)
         .mark_line(point=True)
         .encode(
-            x=alt.X(
-                "fecha:T",
-                title="Fecha",
-                axis=alt.Axis(
-                    format="%a %d",  # lun 18 (depende de locale del sistema)
-                    labelAngle=0,
-                    tickCount="day",
-                ),
-            ),
-            y=alt.Y(f"{y_col}:Q", title=y_title),
+            x=x,
+            y=y,
             color=alt.Color("empresa:N", title="Empresa"),
-            tooltip=[
-                alt.Tooltip("fecha:T", title="Fecha", format="%A %d"),
-                alt.Tooltip("empresa:N", title="Empresa"),
-                alt.Tooltip(f"{y_col}:Q", title=y_title, format=",.2f"),
-            ],
+            tooltip=tooltip,
         )
-        .properties(height=420)
-        .interactive()
     )
 
+    # Resalta los días sospechosos con un rombo rojo
+    if "anomalia" in df_plot.columns and df_plot["anomalia"].any():
+        sospechosos = (
+            alt.Chart(df_plot[df_plot["anomalia"]])
+            .mark_point(shape="diamond", size=140, filled=True, color="#EF4444")
+            .encode(x=x, y=y, tooltip=tooltip + [alt.Tooltip("anomalia:N", title="Sospechoso")])
+        )
+        chart = chart + sospechosos
+
+    return chart.properties(height=420).interactive()
+
 
 def build_data(y_col: str):
+    if hay_anomalias:
+        return df_f.groupby(["fecha", "empresa"], as_index=False).agg(
+            **{y_col: (y_col, "sum"), "anomalia": ("anomalia", "any")}
+        )
     out = df_f.groupby(["fecha", "empresa"], as_index=False)[y_col].sum()
     return out
 
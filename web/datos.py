@@ -0,0 +1,411 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+
+# -------------------------------
+# Huella de versión de los datos
+# -------------------------------
+_BLOQUE_MUESTRA = 64 * 1024  # bytes leídos por muestra
+
+
+def huella_archivo(ruta) -> str:
+    """
+    Huella barata de la versión de un archivo de datos.
+
+    Combina tamaño, fecha de modificación (ns) y un hash de tres bloques
+    muestreados (inicio, mitad y final), sin leer el archivo completo.
+    Se pasa como argumento a las funciones con @st.cache_data para que un
+    cambio en el archivo invalide solo las entradas que dependen de él.
+    """
+    st_info = os.stat(ruta)
+    tam = st_info.st_size
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{tam}:{st_info.st_mtime_ns}".encode())
+
+    with open(ruta, "rb") as f:
+        for pos in (0, max(0, tam // 2 - _BLOQUE_MUESTRA // 2), max(0, tam - _BLOQUE_MUESTRA)):
+            f.seek(pos)
+            h.update(f.read(_BLOQUE_MUESTRA))
+
+    return h.hexdigest()
+
+
+# -------------------------------
+# Filtro por fechas y empresas
+# -------------------------------
+def filtrar_registro(df, desde, hasta, empresas=None):
+    """
+    Filas de `df` con desde <= fecha <= hasta y empresa en `empresas`.
+
+    Requiere `df` ordenado por "fecha" (lo garantiza el cargador): el rango
+    de fechas se resuelve con searchsorted y un corte por posición, sin
+    copiar. Solo si hay que descartar empresas se hace una máscara, y su
+    resultado ocupa lo mismo que la salida. Con `empresas=None` (o todas)
+    se devuelve el corte tal cual. El resultado es de solo lectura: puede
+    compartir memoria con `df`.
+    """
+    fechas = df["fecha"]
+    i0 = fechas.searchsorted(desde, side="left")
+    i1 = fechas.searchsorted(hasta, side="right")
+    sub = df.iloc[i0:i1]
+
+    if empresas is None:
+        return sub
+    empresas = set(empresas)
+    if empresas.issuperset(sub["empresa"].unique()):
+        return sub
+    return sub[sub["empresa"].isin(empresas)]
+
+
+# -------------------------------
+# Anomalías en el registro diario (se calculan al ingerir)
+# -------------------------------
+VEL_MIN_KMH = 3.0  # velocidad media plausible (km / tiempo en movimiento)
+VEL_MAX_KMH = 70.0
+Z_MAX = 3.5  # |z| a partir del cual un día es atípico para su empresa
+VENTANA_Z = 28  # registros previos de la empresa usados como referencia
+MIN_PERIODOS_Z = 7
+
+COLUMNAS_ANOMALIA = [
+    "km_sin_tiempo",
+    "tiempo_sin_km",
+    "kg_sin_km",
+    "velocidad_atipica",
+    "z_atipico",
+    "anomalia",
+]
+
+
+def marcar_anomalias(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega banderas de calidad a registros diarios reales
+    (fecha, empresa, km, Kg, tiempo y, si existe, consumo).
+
+    - Razones imposibles: km sin tiempo, tiempo sin km, Kg sin km, y
+      velocidad media fuera de [VEL_MIN_KMH, VEL_MAX_KMH].
+    - z-score móvil por empresa de km, velocidad (km/h) y consumo/km,
+      contra los VENTANA_Z registros anteriores de la misma empresa. Kg y
+      tiempo varían mucho de un día a otro sin ser errores; entran solo en
+      las razones. `puntaje_anomalia` es el mayor |z| del día y
+      `z_atipico` indica si pasa Z_MAX.
+    - `anomalia` resume todas las banderas.
+
+    Todo es vectorizado; se corre una vez en relleno_registro.py y las
+    banderas viajan con los datos, así que los tableros no recalculan nada.
+    """
+    out = df.sort_values(["empresa", "fecha"], kind="stable")
+    km, kg, tiempo = out["km"], out["Kg"], out["tiempo"]
+
+    metricas = pd.DataFrame(
+        {
+            "km": km,
+            "velocidad": km / tiempo.where(tiempo > 0),
+        }
+    )
+    if "consumo" in out.columns:
+        consumo = pd.to_numeric(out["consumo"], errors="coerce")
+        metricas["consumo_km"] = consumo / km.where(km > 0)
+
+    # Media y desviación de los registros previos (shift: el día no se
+    # compara consigo mismo)
+    empresa = out["empresa"]
+    previos = metricas.groupby(empresa).shift()
+    ventana = previos.groupby(empresa).rolling(VENTANA_Z, min_periods=MIN_PERIODOS_Z)
+    media = ventana.mean().droplevel(0)
+    desv = ventana.std().droplevel(0)
+    z = ((metricas - media) / desv.where(desv > 0)).abs()
+
+    velocidad = metricas["velocidad"]
+    out["km_sin_tiempo"] = (km > 0) & ~(tiempo > 0)
+    out["tiempo_sin_km"] = (tiempo > 0) & ~(km > 0)
+    out["kg_sin_km"] = (kg > 0) & ~(km > 0)
+    out["velocidad_atipica"] = (velocidad < VEL_MIN_KMH) | (velocidad > VEL_MAX_KMH)
+    out["puntaje_anomalia"] = z.max(axis=1).fillna(0.0)
+    out["z_atipico"] = out["puntaje_anomalia"] > Z_MAX
+    out["anomalia"] = out[COLUMNAS_ANOMALIA[:-1]].any(axis=1)
+
+    return out.sort_index()
+
+
+# -------------------------------
+# Carga concurrente de fuentes (fan-out)
+# -------------------------------
+MAX_HILOS_CARGA = 4  # fuentes cargándose a la vez en cada llamada
+TIMEOUT_FUENTE_S = 60.0
+
+# Lector de Excel: calamine (Rust) da el mismo DataFrame que openpyxl en
+# una fracción del tiempo; openpyxl queda si python-calamine no está.
+try:
+    import python_calamine  # noqa: F401
+
+    MOTOR_EXCEL = "calamine"
+except ImportError:
+    MOTOR_EXCEL = "openpyxl"
+
+
+def leer_excel(ruta, **kwargs) -> pd.DataFrame:
+    """pd.read_excel con MOTOR_EXCEL."""
+    return pd.read_excel(ruta, engine=MOTOR_EXCEL, **kwargs)
+
+
+@dataclass(frozen=True)
+class Fuente:
+    """
+    Una fuente de datos para cargar_fuentes.
+
+    `cargar` no recibe argumentos y devuelve los datos ya procesados
+    (normalmente llama a un cargador con @st.cache_data / @st.cache_resource,
+    así que en un rerun con caché la respuesta es inmediata). Para sumar una
+    fuente nueva basta con construir otra Fuente; ver fuente_directorio.
+    """
+
+    nombre: str
+    cargar: Callable[[], Any]
+    timeout: float = TIMEOUT_FUENTE_S
+
+
+def fuente_directorio(nombre, directorio, patron="*.csv", leer=pd.read_csv, timeout=TIMEOUT_FUENTE_S):
+    """
+    Fuente que une en un solo DataFrame todos los archivos de `directorio`
+    que cumplen `patron` (p. ej. CSV dejados por un proceso externo o un
+    volcado local de telemetría). Agrega la columna "archivo" con el origen.
+    """
+
+    def cargar():
+        archivos = sorted(Path(directorio).glob(patron))
+        if not archivos:
+            return pd.DataFrame()
+        return pd.concat(
+            [leer(a).assign(archivo=a.name) for a in archivos], ignore_index=True
+        )
+
+    return Fuente(nombre, cargar, timeout)
+
+
+def _con_contexto_streamlit(cargar):
+    """
+    Envuelve `cargar` para que corra con el ScriptRunContext de la sesión
+    que la pidió; sin él, Streamlit avisa "missing ScriptRunContext" en cada
+    llamada a una función cacheada desde otro hilo.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return cargar
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return cargar
+
+    def cargar_con_ctx():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return cargar()
+
+    return cargar_con_ctx
+
+
+def cargar_fuentes(fuentes, max_hilos=MAX_HILOS_CARGA):
+    """
+    Carga las `fuentes` en paralelo, a lo más `max_hilos` a la vez, y
+    devuelve (datos, errores): dos dicts por nombre de fuente.
+
+    Son hilos: se solapan las esperas (disco, red) y el código que suelta
+    el GIL. Parsear Excel (openpyxl o calamine) retiene el GIL, así que dos
+    fuentes Excel tardan casi lo mismo que en serie; lo que las abarata es
+    leerlas con leer_excel.
+
+    Cada llamada usa sus propios hilos, así que una sesión no espera por
+    las cargas de otra. El timeout de cada fuente se cuenta desde que
+    empieza a cargarse (no desde que entra a la cola); si vence, su error
+    es un TimeoutError y su cupo pasa a la siguiente fuente. El hilo
+    vencido no se puede detener: termina en segundo plano (si lo hace a
+    través de un cargador cacheado, el siguiente rerun lo encuentra listo).
+    """
+    pendientes = list(fuentes)
+    terminadas = queue.SimpleQueue()
+    en_curso = {}  # nombre -> (fuente, instante en que vence)
+    datos, errores = {}, {}
+
+    def correr(nombre, cargar):
+        try:
+            terminadas.put((nombre, True, cargar()))
+        except Exception as e:
+            terminadas.put((nombre, False, e))
+
+    while pendientes or en_curso:
+        while pendientes and len(en_curso) < max_hilos:
+            fuente = pendientes.pop(0)
+            hilo = threading.Thread(
+                target=correr,
+                args=(fuente.nombre, _con_contexto_streamlit(fuente.cargar)),
+                name=f"carga-{fuente.nombre}",
+                daemon=True,
+            )
+            en_curso[fuente.nombre] = (fuente, time.monotonic() + fuente.timeout)
+            hilo.start()
+
+        espera = min(vence for _, vence in en_curso.values()) - time.monotonic()
+        try:
+            nombre, ok, valor = terminadas.get(timeout=max(0.0, espera))
+        except queue.Empty:
+            ahora = time.monotonic()
+            for nombre, (fuente, vence) in list(en_curso.items()):
+                if vence <= ahora:
+                    del en_curso[nombre]
+                    errores[nombre] = TimeoutError(
+                        f"La fuente '{nombre}' no terminó en {fuente.timeout:g} s"
+                    )
+            continue
+
+        if nombre in en_curso:  # si no, ya se dio por vencida
+            del en_curso[nombre]
+            (datos if ok else errores)[nombre] = valor
+
+    return datos, errores
+
+
+# -------------------------------
+# Malla diaria binaria (fecha × empresa × métrica) en memoria mapeada
+# -------------------------------
+def _ruta_meta(ruta_malla):
+    return Path(ruta_malla).with_suffix(".json")
+
+
+def guardar_malla(df_full, empresas, metricas, ruta_malla, huella_fuente=None, huella_excel=None):
+    """
+    Guarda la malla densa de relleno_registro.py como un .npy float64 de
+    forma (fechas, empresas, métricas) y un .json al lado con el origen de
+    fechas y las tablas de empresas y métricas.
+
+    `df_full` debe tener una fila por cada (fecha, empresa) de días
+    consecutivos, ordenada por fecha y luego por `empresas`; si no (faltan
+    días o filas, hay duplicados), se borra la malla anterior y se lanza
+    ValueError: una malla corrida un día daría cifras equivocadas sin
+    error. Las banderas booleanas se guardan como 0/1 y se recuperan como
+    bool al leer.
+    `huella_excel` es la huella del Excel con los mismos datos: el tablero
+    solo usa la malla mientras ese Excel no cambie.
+
+    Ambos archivos se escriben aparte y luego se reemplazan (primero el
+    .json, al final el .npy), así que los procesos que ya tienen la malla
+    mapeada siguen leyendo la versión anterior sin errores. Los dos
+    reemplazos no son atómicos en conjunto: el .json guarda la huella del
+    .npy y abrir_malla rechaza una pareja que no coincide.
+    """
+    ruta_malla = Path(ruta_malla)
+    ruta_meta = _ruta_meta(ruta_malla)
+
+    fechas = pd.date_range(df_full["fecha"].min(), df_full["fecha"].max(), freq="D")
+    completa = pd.MultiIndex.from_product([fechas, list(empresas)])
+    if not pd.MultiIndex.from_frame(df_full[["fecha", "empresa"]]).equals(completa):
+        ruta_meta.unlink(missing_ok=True)
+        ruta_malla.unlink(missing_ok=True)
+        raise ValueError(
+            f"Los datos no forman la malla completa de {len(fechas)} días × "
+            f"{len(empresas)} empresas en orden; no se escribe {ruta_malla}"
+        )
+
+    forma = (len(fechas), len(empresas), len(metricas))
+    valores = df_full[metricas].to_numpy(dtype=np.float64).reshape(forma)
+
+    meta = {
+        "origen": fechas[0].strftime("%Y-%m-%d"),
+        "empresas": list(empresas),
+        "metricas": list(metricas),
+        "booleanas": [m for m in metricas if df_full[m].dtype == bool],
+        "forma": list(forma),
+        "huella_fuente": huella_fuente,
+        "huella_excel": huella_excel,
+    }
+
+    tmp_malla = ruta_malla.with_name(ruta_malla.name + ".tmp")
+    tmp_meta = ruta_meta.with_name(ruta_meta.name + ".tmp")
+
+    malla = np.lib.format.open_memmap(tmp_malla, mode="w+", dtype=np.float64, shape=forma)
+    malla[:] = valores
+    malla.flush()
+    del malla
+    # os.replace conserva tamaño y mtime, así que la huella sigue valiendo
+    meta["huella_malla"] = huella_archivo(tmp_malla)
+    tmp_meta.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    os.replace(tmp_meta, ruta_meta)
+    os.replace(tmp_malla, ruta_malla)
+
+
+def leer_meta_malla(ruta_malla):
+    """Sidecar .json de la malla, o None si no existe."""
+    ruta_meta = _ruta_meta(ruta_malla)
+    if not ruta_meta.exists():
+        return None
+    return json.loads(ruta_meta.read_text(encoding="utf-8"))
+
+
+def abrir_malla(ruta_malla):
+    """
+    Abre la malla en modo solo lectura mapeado en memoria y devuelve
+    (malla, meta). No se lee nada del arreglo hasta que se rebana; varios
+    procesos comparten las mismas páginas del caché del sistema.
+
+    Lanza ValueError si el .npy no es el que describe su .json (p. ej. a
+    mitad de un guardar_malla); quien llama debe usar el Excel.
+    """
+    meta = leer_meta_malla(ruta_malla)
+    if meta is None:
+        raise FileNotFoundError(_ruta_meta(ruta_malla))
+    malla = np.load(ruta_malla, mmap_mode="r")
+    # Después de mapear: si el .npy se reemplazó entre medio, no coincide
+    if meta.get("huella_malla") != huella_archivo(ruta_malla):
+        raise ValueError(f"La malla {ruta_malla} no corresponde a su .json")
+    if list(malla.shape) != meta["forma"]:
+        raise ValueError(
+            f"La malla {ruta_malla} tiene forma {malla.shape} y su .json dice {meta['forma']}"
+        )
+    return malla, meta
+
+
+def filtrar_malla(malla, meta, desde, hasta, empresas=None) -> pd.DataFrame:
+    """
+    Equivalente a filtrar_registro sobre la malla: devuelve en formato
+    largo (fecha, empresa, métricas...) solo los días y empresas pedidos.
+
+    Fechas y empresas se convierten en índices con aritmética sobre el
+    origen y la tabla de empresas; solo se leen (y se asignan) las celdas
+    de la salida.
+    """
+    origen = pd.Timestamp(meta["origen"])
+    n_fechas = malla.shape[0]
+    i0 = min(max((pd.Timestamp(desde) - origen).days, 0), n_fechas)
+    i1 = min(max((pd.Timestamp(hasta) - origen).days + 1, i0), n_fechas)
+
+    nombres = meta["empresas"]
+    if empresas is None:
+        cols = list(range(len(nombres)))
+        sub = malla[i0:i1]
+    else:
+        pedidas = set(empresas)
+        cols = [j for j, e in enumerate(nombres) if e in pedidas]
+        sub = malla[i0:i1, cols]
+
+    n_f, n_e = i1 - i0, len(cols)
+    valores = np.asarray(sub).reshape(n_f * n_e, malla.shape[2])
+
+    out = {
+        "fecha": np.repeat(origen + pd.to_timedelta(np.arange(i0, i1), unit="D"), n_e),
+        "empresa": np.tile(np.array(nombres, dtype=object)[cols], n_f),
+    }
+    booleanas = set(meta.get("booleanas", []))
+    for k, m in enumerate(meta["metricas"]):
+        out[m] = valores[:, k] != 0 if m in booleanas else valores[:, k]
+    return pd.DataFrame(out)
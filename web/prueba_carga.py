@@ -0,0 +1,257 @@
+"""
+Prueba de carga de los tableros con sesiones simultáneas.
+
+Cada usuario simulado es un AppTest de Streamlit (ejecución en proceso,
+sin navegador) que cambia al azar el rango de fechas y las empresas y
+vuelve a ejecutar el script. Al final reporta latencia por rerun
+(p50/p95/p99), la primera ejecución de cada sesión (en frío) por separado,
+throughput y RSS máximo del proceso (es un pico acumulado: con --app
+todas, la segunda app incluye el de la primera).
+
+Para correr sesiones en paralelo se reemplazan piezas internas de
+Streamlit (ver runtime_compartido), probadas solo con STREAMLIT_PROBADO.
+Con otra versión el script se niega a correr salvo con --ignorar-version.
+
+Ejecutar desde la raíz del repositorio (igual que `streamlit run`), porque
+los tableros abren los Excel con rutas relativas "web/...":
+
+    python web/prueba_carga.py --app app2.py --usuarios 24 --reruns 10
+"""
+
+import argparse
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+import streamlit
+
+# Versión (mayor.menor) de Streamlit con la que se probó runtime_compartido
+STREAMLIT_PROBADO = "1.66"
+
+try:
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import (
+        MemoryCacheStorageManager,
+    )
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1 import app_test, local_script_runner
+except ImportError as e:
+    raise SystemExit(
+        f"prueba_carga.py usa módulos internos de Streamlit {STREAMLIT_PROBADO}.x "
+        f"que no existen en la versión instalada ({streamlit.__version__}): {e}"
+    )
+
+WEB_DIR = Path(__file__).resolve().parent
+
+
+def version_probada():
+    return streamlit.__version__.split(".")[:2] == STREAMLIT_PROBADO.split(".")
+
+
+# -------------------------------
+# Runtime compartido entre sesiones
+# -------------------------------
+@contextmanager
+def runtime_compartido(scripts=()):
+    """
+    AppTest instala un Runtime simulado global al inicio de cada run() y lo
+    borra al terminar, así que dos sesiones en paralelo se pisan ("Runtime
+    hasn't been created!"). Además crea ScriptCaches por run(), y compilar
+    el mismo script desde varios hilos a la vez falla en algunas versiones
+    de CPython. Como en un servidor real, aquí todas las sesiones comparten
+    un único Runtime (con su caché) y un único ScriptCache, en el que
+    `scripts` se compilan antes de arrancar las sesiones.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    componentes = BidiComponentManager()
+    componentes.discover_and_register_components(start_file_watching=False)
+    runtime.bidi_component_registry = componentes
+
+    script_cache = ScriptCache()
+    for script in scripts:
+        script_cache.get_bytecode(str(script))
+
+    runtime_original = app_test.Runtime
+    script_cache_original = ScriptCache
+    # Las asignaciones de AppTest van a una clase local sin efecto
+    app_test.Runtime = type("RuntimePorSesion", (), {"_instance": None})
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    Runtime._instance = runtime
+    try:
+        yield runtime
+    finally:
+        Runtime._instance = None
+        app_test.Runtime = runtime_original
+        app_test.ScriptCache = local_script_runner.ScriptCache = script_cache_original
+
+
+# -------------------------------
+# Cambios de filtro al azar
+# -------------------------------
+def _empresas_al_azar(rng, opciones):
+    k = rng.randint(1, len(opciones))
+    return rng.sample(list(opciones), k)
+
+
+def _filtrar_app2(at, rng):
+    fechas = at.date_input[0]
+    d_min, d_max = fechas.min, fechas.max
+    dias = (d_max - d_min).days
+    a, b = sorted(rng.randint(0, dias) for _ in range(2))
+    fechas.set_value((d_min + timedelta(days=a), d_min + timedelta(days=b)))
+
+    empresas = at.multiselect[0]
+    empresas.set_value(_empresas_al_azar(rng, empresas.options))
+
+
+def _filtrar_app(at, rng):
+    empresas = at.sidebar.multiselect[0]
+    empresas.set_value(_empresas_al_azar(rng, empresas.options))
+
+
+FILTROS = {
+    "app.py": _filtrar_app,
+    "app2.py": _filtrar_app2,
+}
+
+
+# -------------------------------
+# Usuario simulado
+# -------------------------------
+def _errores(at):
+    # Excepciones no capturadas y st.error (p. ej. antes de un st.stop())
+    return [e.message for e in at.exception] + [e.value for e in at.error]
+
+
+def simular_usuario(app, reruns, semilla, timeout):
+    """
+    Abre una sesión, aplica `reruns` cambios de filtro y devuelve
+    (primera ejecución en segundos, latencias de los reruns, errores).
+    """
+    rng = random.Random(semilla)
+    filtrar = FILTROS[app]
+
+    at = AppTest.from_file(str(WEB_DIR / app), default_timeout=timeout)
+    latencias = []
+
+    # La primera ejecución carga datos y llena cachés: se mide aparte
+    t0 = time.perf_counter()
+    at.run()
+    frio = time.perf_counter() - t0
+
+    for _ in range(reruns):
+        errores = _errores(at)
+        if errores:
+            break
+        filtrar(at, rng)
+        t0 = time.perf_counter()
+        at.run()
+        latencias.append(time.perf_counter() - t0)
+    else:
+        errores = _errores(at)
+
+    return frio, latencias, errores
+
+
+def _rss_max_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS, bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def prueba_carga(app, usuarios, reruns, semilla=0, timeout=120):
+    """Corre `usuarios` sesiones en paralelo y devuelve un dict con métricas."""
+    inicio = threading.Barrier(usuarios)
+
+    def tarea(i):
+        inicio.wait()  # todas las sesiones arrancan a la vez
+        return simular_usuario(app, reruns, semilla + i, timeout)
+
+    t0 = time.perf_counter()
+    with runtime_compartido([WEB_DIR / app]), ThreadPoolExecutor(max_workers=usuarios) as pool:
+        resultados = list(pool.map(tarea, range(usuarios)))
+    total_s = time.perf_counter() - t0
+
+    frios = np.array([frio for frio, _, _ in resultados])
+    latencias = np.array([x for _, lat, _ in resultados for x in lat])
+    errores = [e for _, _, errs in resultados for e in errs]
+    p50, p95, p99 = np.percentile(latencias, [50, 95, 99]) if latencias.size else (np.nan,) * 3
+    ejecuciones = frios.size + latencias.size
+
+    return {
+        "app": app,
+        "usuarios": usuarios,
+        "reruns": int(latencias.size),
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "frio_p50_ms": np.median(frios) * 1000,
+        "frio_max_ms": frios.max() * 1000,
+        # Ejecuciones (en frío + reruns) por segundo de reloj
+        "throughput_rps": ejecuciones / total_s if total_s > 0 else float("nan"),
+        "duracion_s": total_s,
+        "rss_max_mb": _rss_max_mb(),
+        "errores": errores,
+    }
+
+
+def _imprimir(r):
+    print(
+        f"{r['app']:<8} usuarios={r['usuarios']:<4} reruns={r['reruns']:<5} "
+        f"p50={r['p50_ms']:.0f}ms p95={r['p95_ms']:.0f}ms p99={r['p99_ms']:.0f}ms "
+        f"frío p50={r['frio_p50_ms']:.0f}ms máx={r['frio_max_ms']:.0f}ms "
+        f"throughput={r['throughput_rps']:.2f} ejecuciones/s "
+        f"duración={r['duracion_s']:.1f}s rss_max={r['rss_max_mb']:.0f}MB"
+    )
+    for e in r["errores"][:5]:
+        print("  error:", e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", choices=[*FILTROS, "todas"], default="todas")
+    parser.add_argument("--usuarios", type=int, default=16, help="sesiones simultáneas")
+    parser.add_argument("--reruns", type=int, default=10, help="cambios de filtro por sesión")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="segundos por rerun")
+    parser.add_argument(
+        "--ignorar-version",
+        action="store_true",
+        help=f"correr aunque Streamlit no sea {STREAMLIT_PROBADO}.x",
+    )
+    args = parser.parse_args(argv)
+
+    if not version_probada() and not args.ignorar_version:
+        parser.error(
+            f"probado con Streamlit {STREAMLIT_PROBADO}.x y está instalado "
+            f"{streamlit.__version__}; revisa runtime_compartido o usa --ignorar-version"
+        )
+
+    apps = list(FILTROS) if args.app == "todas" else [args.app]
+    hubo_errores = False
+    for app in apps:
+        r = prueba_carga(app, args.usuarios, args.reruns, args.semilla, args.timeout)
+        _imprimir(r)
+        hubo_errores |= bool(r["errores"])
+
+    return 1 if hubo_errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
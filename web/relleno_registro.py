@@ -1,15 +1,181 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+
 import pandas as pd
+from openpyxl import load_workbook
+
+import datos
+from datos import (
+    COLUMNAS_ANOMALIA,
+    guardar_malla,
+    huella_archivo,
+    leer_meta_malla,
+    marcar_anomalias,
+)
 
 # --- Ajusta rutas si hace falta ---
 infile = "web/registro_semanal.xlsx"
 outfile = "web/registro_semanal_completo.xlsx"
+# Misma malla en binario (.npy + .json) para leerla mapeada en memoria
+mallafile = "web/registro_diario.npy"
+
+# Columnas que agrega la validación (además de las de COLUMNAS_ANOMALIA)
+COLUMNAS_VALIDACION = ["puntaje_anomalia", *COLUMNAS_ANOMALIA, "relleno"]
+
+# Descripción del Excel de salida tras --solo-banderas (la corrida completa
+# guarda ahí su huella de 32 hex)
+MARCA_SOLO_BANDERAS = "solo-banderas"
+
+parser = argparse.ArgumentParser(description="Rellena el registro diario y marca anomalías.")
+parser.add_argument(
+    "--solo-banderas",
+    action="store_true",
+    help=f"no regenera {outfile}: solo recalcula las banderas sobre su Hoja1 "
+    "actual (conserva ediciones a mano) y deja intactas las demás hojas",
+)
+parser.add_argument(
+    "--forzar",
+    action="store_true",
+    help=f"regenera {outfile} aunque no lo haya generado una corrida completa "
+    "(p. ej. tras --solo-banderas o ediciones a mano), perdiendo esas ediciones",
+)
+args = parser.parse_args()
+
+
+def _validar(df_real):
+    # Validación y puntaje de anomalías sobre los días con registro real
+    # (los ceros del relleno no son datos)
+    return marcar_anomalias(df_real)
+
+
+def _leer_entrada():
+    # --- Lee hoja principal ---
+    df = pd.read_excel(infile, sheet_name=0)
+
+    # Normaliza columnas (ajusta nombres si en tu archivo están distintos)
+    df.columns = [c.strip() for c in df.columns]
+    df["fecha"] = pd.to_datetime(df["fecha"])
+
+    # "consumo" (coma decimal) solo se usa para validar (consumo/km)
+    if "consumo" in df.columns:
+        df["consumo"] = pd.to_numeric(
+            df["consumo"].astype(str).str.replace(",", ".", regex=False), errors="coerce"
+        )
+    return df
+
+
+def _escribir_malla(df_full, huella_fuente):
+    # Malla binaria (fechas × empresas × métricas) con la huella del Excel
+    # ya escrito: app2 solo la usa mientras ese Excel no cambie
+    empresas = sorted(df_full["empresa"].unique())
+    df_full = df_full.set_index(["fecha", "empresa"])
 
-# --- Lee hoja principal ---
-df = pd.read_excel(infile, sheet_name=0)
+    # Días que falten en Hoja1 (p. ej. borrados a mano) entran como relleno,
+    # igual que en la corrida completa. Con duplicados no se rellena y
+    # guardar_malla rechaza los datos.
+    if df_full.index.is_unique:
+        fechas = pd.date_range(df_full.index.levels[0].min(), df_full.index.levels[0].max(), freq="D")
+        completa = pd.MultiIndex.from_product([fechas, empresas], names=["fecha", "empresa"])
+        faltan = ~completa.isin(df_full.index)
+        df_full = df_full.reindex(completa)
+        for col in df_full.columns:
+            es_bandera = col in COLUMNAS_VALIDACION and col != "puntaje_anomalia"
+            df_full[col] = df_full[col].fillna(False).astype(bool) if es_bandera else df_full[col].fillna(0)
+        df_full["relleno"] = df_full["relleno"] | faltan
 
-# Normaliza columnas (ajusta nombres si en tu archivo están distintos)
-df.columns = [c.strip() for c in df.columns]
-df["fecha"] = pd.to_datetime(df["fecha"])
+    df_full = df_full.reset_index().sort_values(["fecha", "empresa"], kind="stable")
+    guardar_malla(
+        df_full,
+        empresas,
+        [c for c in df_full.columns if c not in ("fecha", "empresa")],
+        mallafile,
+        huella_fuente=huella_fuente,
+        huella_excel=huella_archivo(outfile),
+    )
+
+
+if args.solo_banderas:
+    # --- Banderas sobre la Hoja1 existente ---
+    xls = pd.ExcelFile(outfile)
+    hoja1_nombre = xls.sheet_names[0]
+    df_full = pd.read_excel(xls, sheet_name=hoja1_nombre)
+    df_full = df_full.drop(columns=COLUMNAS_VALIDACION, errors="ignore")
+    df_full["fecha"] = pd.to_datetime(df_full["fecha"])
+
+    # Hoja1 no guarda el consumo: se toma de la entrada para validar
+    # consumo/km igual que la corrida completa
+    entrada = _leer_entrada()
+    if "consumo" in entrada.columns:
+        consumo = entrada.groupby(["fecha", "empresa"], as_index=False)["consumo"].sum(min_count=1)
+        df_full = df_full.merge(consumo, on=["fecha", "empresa"], how="left")
+
+    # Un día sin km, Kg ni tiempo es relleno
+    relleno = (df_full[["km", "Kg", "tiempo"]].fillna(0) == 0).all(axis=1)
+    marcadas = _validar(df_full[~relleno])
+
+    # Mismas columnas y en el mismo orden que la corrida completa
+    for col in marcadas.columns.intersection(COLUMNAS_VALIDACION):
+        vacio = 0.0 if col == "puntaje_anomalia" else False
+        df_full[col] = marcadas[col].reindex(df_full.index, fill_value=vacio)
+    df_full["relleno"] = relleno
+    df_full = df_full.drop(columns="consumo", errors="ignore")
+
+    # Reemplaza solo la Hoja1; Hoja2 y las demás quedan como están
+    with pd.ExcelWriter(outfile, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+        df_full.to_excel(writer, sheet_name=hoja1_nombre, index=False)
+        # Ya no es la salida tal cual de una corrida completa: la siguiente
+        # no lo reemplaza sin --forzar
+        writer.book.properties.description = MARCA_SOLO_BANDERAS
+
+    _escribir_malla(df_full, None)
+
+    print("Banderas actualizadas:", outfile, mallafile)
+    sys.exit(0)
+
+# --- Si ni la entrada ni el proceso cambiaron, no se reescriben las salidas ---
+# La huella combina la del archivo de entrada con el código que lo
+# transforma (este script y datos.py): cambiar, p. ej., Z_MAX regenera.
+# Queda en las propiedades del Excel de salida y en el .json de la malla
+# (que además guarda la huella del Excel). Reescribirlos sin cambios
+# alteraría su huella e invalidaría la caché de los tableros sin motivo.
+h = hashlib.blake2b(huella_archivo(infile).encode(), digest_size=16)
+for codigo in (__file__, datos.__file__):
+    with open(codigo, "rb") as f:
+        h.update(f.read())
+huella_in = h.hexdigest()
+descripcion = None
+if os.path.exists(outfile):
+    descripcion = load_workbook(outfile, read_only=True).properties.description
+if descripcion == huella_in and os.path.exists(mallafile):
+    meta = leer_meta_malla(mallafile) or {}
+    if meta.get("huella_fuente") == huella_in and meta.get("huella_excel") == huella_archivo(outfile):
+        print("Sin cambios:", outfile, mallafile)
+        sys.exit(0)
+
+# La corrida completa reescribe Hoja1 desde la entrada y copia sus demás
+# hojas: solo reemplaza un Excel que ella misma generó (con su huella en
+# la descripción). Uno sin huella (editado a mano, o pasado por
+# --solo-banderas) se respeta salvo con --forzar.
+if (
+    os.path.exists(outfile)
+    and not args.forzar
+    and not re.fullmatch(r"[0-9a-f]{32}", descripcion or "")
+):
+    sys.exit(
+        f"{outfile} no lo generó una corrida completa (descripción: {descripcion!r}); "
+        "regenerarlo perdería sus ediciones a mano (Hoja2 incluida). "
+        "Usa --solo-banderas para actualizar solo las banderas o --forzar para regenerarlo."
+    )
+
+df = _leer_entrada()
+
+# Métricas a agregar; "consumo" solo se usa para validar
+metricas = ["km", "Kg", "tiempo"]
+if "consumo" in df.columns:
+    metricas.append("consumo")
 
 # Rango de fechas fijo
 start = pd.Timestamp("2025-08-18")
@@ -24,16 +190,22 @@ grid = pd.MultiIndex.from_product([full_dates, empresas], names=["fecha", "empre
 
 # Si tienes varias filas por día/empresa, primero agrupa (recomendado)
 df_agg = (
-    df.groupby(["fecha", "empresa"], as_index=False)[["km", "Kg", "tiempo"]]
-      .sum()
+    df.groupby(["fecha", "empresa"], as_index=False)[metricas]
+      .sum(min_count=1)
 )
 
-# Une el grid con los datos
-df_full = grid.merge(df_agg, on=["fecha", "empresa"], how="left")
+df_agg = _validar(df_agg)
 
-# Rellena faltantes con 0
-for col in ["km", "Kg", "tiempo"]:
+# Une el grid con los datos; "relleno" marca los días sin registro
+df_full = grid.merge(df_agg, on=["fecha", "empresa"], how="left", indicator="relleno")
+df_full["relleno"] = df_full["relleno"] == "left_only"
+
+# Rellena faltantes con 0 (y sin banderas)
+for col in ["km", "Kg", "tiempo", "puntaje_anomalia"]:
     df_full[col] = df_full[col].fillna(0)
+for col in COLUMNAS_ANOMALIA:
+    df_full[col] = df_full[col].fillna(False).astype(bool)
+df_full = df_full.drop(columns="consumo", errors="ignore")
 
 # (Opcional) Asegurar tipos
 df_full["km"] = df_full["km"].astype(float)
@@ -50,4 +222,10 @@ with pd.ExcelWriter(outfile, engine="openpyxl") as writer:
     for sh in xls.sheet_names[1:]:
         pd.read_excel(infile, sheet_name=sh).to_excel(writer, sheet_name=sh, index=False)
 
-print("Listo:", outfile)
+    # Versión de la entrada con la que se generó este archivo
+    writer.book.properties.description = huella_in
+
+# --- Escribe la malla binaria (después del Excel, para llevar su huella) ---
+_escribir_malla(df_full, huella_in)
+
+print("Listo:", outfile, mallafile)